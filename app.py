@@ -1,9 +1,19 @@
+import asyncio
+import base64
+import functools
 import gradio as gr
-import requests
-import json
+import hashlib
+import httpx
+import ijson
 import logging
+import orjson
 import os
+import re
 import time
+from urllib.parse import quote
+import websockets
+from websockets.exceptions import ConnectionClosedOK, WebSocketException
+from cachetools import LRUCache, TLRUCache, TTLCache
 from dotenv import load_dotenv
 
 # --- Pre-run Setup ---
@@ -20,6 +30,10 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Example: BASE_URL="http://localhost:1865"
 BASE_URL = os.getenv("BASE_URL", "http://localhost:1865")
 
+# The WebSocket counterpart of BASE_URL (http -> ws, https -> wss), used to
+# receive bot replies as they are generated.
+WS_URL = re.sub(r"^http", "ws", BASE_URL)
+
 # API endpoint paths for better organization
 API_ENDPOINTS = {
     "token": "/auth/token",
@@ -28,9 +42,83 @@ API_ENDPOINTS = {
     "delete_chat": "/delete_chat",
     "rename_chat": "/memory/collections/points/changeNameChat",
     "get_messages": "/giveAll",
-    "send_message": "/message"
+    "websocket": "/ws"
 }
 
+# Full endpoint URLs, built once at import instead of on every call
+URL = {name: f"{BASE_URL}{path}" for name, path in API_ENDPOINTS.items()}
+URL["websocket"] = f"{WS_URL}{API_ENDPOINTS['websocket']}"
+
+# Minimum time in seconds between chatbot repaints while a reply streams in.
+# Tokens arriving faster than this are held back and flushed together once the
+# interval ends, so the browser and Gradio's event loop are not flooded with
+# one update per token.
+STREAM_UPDATE_INTERVAL = 0.025
+
+# Maximum time in seconds to wait for the first frame of a reply. Long, since a
+# Cat whose LLM does not stream sends nothing until retrieval and generation are
+# done; raise it with FIRST_REPLY_TIMEOUT in the .env file for slow local models.
+FIRST_REPLY_TIMEOUT = float(os.getenv("FIRST_REPLY_TIMEOUT", 120))
+
+# Maximum time in seconds to wait for each further frame of a reply before giving up
+REPLY_TIMEOUT = 30
+
+# Timeout in seconds for each phase (connect, read, write, pool) of an HTTP call
+# to the Cat. Generous, since login, the chat list query and /giveAll can be slow
+# on a busy Cat; httpx's own 5 second default would fail them.
+HTTP_TIMEOUT = 60
+
+# Number of chats at the top of the list whose histories are fetched in the
+# background after login or a manual refresh, so the likely next click is
+# served from cache. Each one costs a full /giveAll download if not clicked.
+PREFETCH_CHATS = 1
+
+# A single pooled async client shared by all API calls, so keep-alive connections
+# to the Cat are reused instead of paying a TCP/TLS handshake on every request,
+# and handlers await the network instead of blocking a worker thread. Over HTTPS
+# the client negotiates HTTP/2, multiplexing concurrent calls on one connection;
+# plain http:// URLs keep using HTTP/1.1.
+CLIENT = httpx.AsyncClient(
+    headers={"Content-Type": "application/json"},
+    timeout=HTTP_TIMEOUT,
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=8)
+    )
+)
+
+# Recently fetched chat histories keyed by (auth_token, chat_id), so switching
+# back and forth between chats does not re-download them. Entries expire after
+# a minute so that changes made from other clients still show up.
+HISTORY_CACHE = TTLCache(maxsize=32, ttl=60)
+
+# History fetches currently in flight, keyed like HISTORY_CACHE, so that bursts
+# of identical requests (login, auto-select, quick clicks) share one round-trip.
+HISTORY_FETCHES = {}
+
+# Last ETag and parsed body per (endpoint, auth_token, chat_id). When the Cat, or
+# a proxy in front of it, sends ETags, unchanged data is revalidated with
+# If-None-Match and comes back with an empty body instead of the full JSON.
+ETAG_CACHE = LRUCache(maxsize=64)
+
+# Statuses meaning "unchanged" for a conditional request. The Cat's endpoints
+# are POSTs, for which RFC 9110 answers a matching If-None-Match with 412
+# rather than the 304 used for GET.
+NOT_MODIFIED_STATUSES = (304, 412)
+
+# Seconds before a token's own expiry at which its cached entry is dropped
+TOKEN_EXPIRY_MARGIN = 60
+
+# Tokens from recent logins keyed by (username, password hash), so logging in
+# again or reloading the page skips the /auth/token round-trip. Values are
+# (token, expires_at): each entry lives until TOKEN_EXPIRY_MARGIN before the
+# token's JWT "exp" claim, and tokens without one are not cached. Entries are
+# also dropped on logout and as soon as the Cat rejects the token with a 401.
+# Until then a cached token is reused as-is, so a password changed on the Cat
+# keeps working here only for as long as its already-issued token stays valid.
+TOKEN_CACHE = TLRUCache(maxsize=16, ttu=lambda key, value, now: value[1], timer=time.time)
+
 
 # --- Logging & Error Handling ---
 
@@ -50,54 +138,97 @@ def log_and_success(message):
     gr.Success(message)
 
 def handle_api_error(e, context="API call"):
-    """Logs a detailed error from a requests exception for better debugging."""
+    """Logs a detailed error from an httpx exception for better debugging."""
     error_message = f"Error in {context}: {e}"
     if hasattr(e, 'response') and e.response is not None:
         try:
-            error_body = e.response.json()
-            error_message += f" | Details: {json.dumps(error_body, indent=2)}"
-        except json.JSONDecodeError:
+            error_body = orjson.loads(e.response.content)
+            error_message += f" | Details: {orjson.dumps(error_body, option=orjson.OPT_INDENT_2).decode()}"
+        except orjson.JSONDecodeError:
             error_message += f" | Details: {e.response.text}"
     log_and_warn(error_message)
 
 
 # --- API Client ---
 
+@functools.lru_cache(maxsize=64)
 def get_headers(auth_token):
-    """Constructs the authorization headers for API requests."""
+    """Constructs the per-request authorization header, once per token (Content-Type is set on the client).
+
+    The returned dict is shared between calls and must not be mutated.
+    """
     if not auth_token:
         raise ValueError("Authentication token is missing.")
-    return {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {auth_token}"
-    }
+    return {"Authorization": f"Bearer {auth_token}"}
+
+def token_expiry(auth_token):
+    """Returns the Unix time from a JWT's "exp" claim, or None if it cannot be read."""
+    try:
+        payload = auth_token.split(".")[1]
+        claims = orjson.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
 
-def get_chats(auth_token):
+def forget_token(auth_token):
+    """Drops every cached login that resolved to the given token."""
+    for key in [key for key, (token, _) in TOKEN_CACHE.items() if token == auth_token]:
+        TOKEN_CACHE.pop(key, None)
+
+async def forget_rejected_token(response):
+    """Response hook: drops a cached login token as soon as the Cat rejects it."""
+    if response.status_code == 401:
+        authorization = response.request.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            forget_token(authorization.removeprefix("Bearer "))
+
+CLIENT.event_hooks = {"response": [forget_rejected_token]}
+
+def with_etag(headers, etag_key):
+    """Adds If-None-Match for a previously seen ETag; returns the headers and the cached body, if any."""
+    cached = ETAG_CACHE.get(etag_key)
+    if cached is None:
+        return headers, None
+    etag, body = cached
+    return {**headers, "If-None-Match": etag}, body
+
+def remember_etag(etag_key, response, body):
+    """Stores the parsed body under the response's ETag, if the server sent one."""
+    etag = response.headers.get("ETag")
+    if etag:
+        ETAG_CACHE[etag_key] = (etag, body)
+
+async def get_chats(auth_token):
     """Fetches all non-deleted chats for the authenticated user."""
     try:
-        headers = get_headers(auth_token)
-        response = requests.post(f"{BASE_URL}{API_ENDPOINTS['get_chats']}", headers=headers)
+        etag_key = ("get_chats", auth_token, None)
+        headers, cached_chats = with_etag(get_headers(auth_token), etag_key)
+        response = await CLIENT.post(URL["get_chats"], headers=headers)
+        if response.status_code in NOT_MODIFIED_STATUSES and cached_chats is not None:
+            return cached_chats
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
+        chats = []
         if "points" in data and data["points"]:
-            return [[p["metadata"].get("name", "Unnamed Chat"), p["id"]] for p in data["points"]]
-        return []
-    except (requests.exceptions.RequestException, ValueError) as e:
+            chats = [[p["metadata"].get("name", "Unnamed Chat"), p["id"]] for p in data["points"]]
+        remember_etag(etag_key, response, chats)
+        return chats
+    except (httpx.HTTPError, ValueError) as e:
         handle_api_error(e, "fetching chats")
         return []
 
-def create_chat(auth_token, chat_name):
+async def create_chat(auth_token, chat_name):
     """Creates a new chat with the given name."""
     try:
         headers = get_headers(auth_token)
         payload = {"metadata": {"name": chat_name, "content": chat_name}}
-        response = requests.post(f"{BASE_URL}{API_ENDPOINTS['create_chat']}", headers=headers, json=payload)
+        response = await CLIENT.post(URL["create_chat"], headers=headers, content=orjson.dumps(payload))
         response.raise_for_status()
         log_and_success(f"Chat '{chat_name}' created successfully!")
-    except (requests.exceptions.RequestException, ValueError) as e:
+    except (httpx.HTTPError, ValueError) as e:
         handle_api_error(e, "creating chat")
 
-def delete_chat(auth_token, chat_id):
+async def delete_chat(auth_token, chat_id):
     """Deletes a specific chat by its ID."""
     if not chat_id:
         log_and_warn("Please select a chat to delete.")
@@ -105,12 +236,12 @@ def delete_chat(auth_token, chat_id):
     try:
         headers = get_headers(auth_token)
         params = {"chat_id": chat_id}
-        response = requests.delete(f"{BASE_URL}{API_ENDPOINTS['delete_chat']}", headers=headers, params=params)
+        response = await CLIENT.delete(URL["delete_chat"], headers=headers, params=params)
         response.raise_for_status()
-    except (requests.exceptions.RequestException, ValueError) as e:
+    except (httpx.HTTPError, ValueError) as e:
         handle_api_error(e, "deleting chat")
 
-def rename_chat(auth_token, chat_id, new_name):
+async def rename_chat(auth_token, chat_id, new_name):
     """Renames a specific chat by its ID."""
     if not chat_id:
         log_and_warn("Please select a chat to rename.")
@@ -122,88 +253,208 @@ def rename_chat(auth_token, chat_id, new_name):
     try:
         headers = get_headers(auth_token)
         params = {"chat_id": chat_id, "name": new_name}
-        response = requests.post(f"{BASE_URL}{API_ENDPOINTS['rename_chat']}", headers=headers, params=params)
+        response = await CLIENT.post(URL["rename_chat"], headers=headers, params=params)
         response.raise_for_status()
         log_and_success(f"Chat {chat_id} renamed to '{new_name}'.")
-    except (requests.exceptions.RequestException, ValueError) as e:
+    except (httpx.HTTPError, ValueError) as e:
         handle_api_error(e, "renaming chat")
 
-def get_chat_messages(auth_token, chat_id):
-    """Fetches all messages for a given chat ID."""
+def invalidate_chat_history(chat_id):
+    """Drops the cached history of a chat, e.g. after it has been changed."""
+    for key in [key for key in HISTORY_CACHE if key[1] == chat_id]:
+        HISTORY_CACHE.pop(key, None)
+    # Fetches already in flight may predate the change: detach them so their
+    # result is neither shared with new callers nor cached.
+    for key in [key for key in HISTORY_FETCHES if key[1] == chat_id]:
+        HISTORY_FETCHES.pop(key, None)
+
+async def get_chat_messages(auth_token, chat_id):
+    """Fetches all messages for a given chat ID, serving recent results from the cache."""
     if not chat_id:
         return [], "Select a chat to see messages"
+    cached = HISTORY_CACHE.get((auth_token, chat_id))
+    if cached is not None:
+        return cached
+    # Errors are reported here rather than in the shared fetch, so that every
+    # caller waiting on it gets the warning, not just the one that started it.
     try:
-        headers = get_headers(auth_token)
-        params = {"chat_id": chat_id}
-        response = requests.post(f"{BASE_URL}{API_ENDPOINTS['get_messages']}", headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
-        
-        chat_name = data.get("Name", "Current Chat")
-        messages = data.get("Messages", {}).get("points", [])
-        
-        history = []
-        for msg in messages:
-            meta = msg.get("metadata", {})
-            # Display user and bot messages in order
-            if meta.get("text"):
-                history.append({"role": "user", "content": meta["text"]})
-            if meta.get("bot"):
-                history.append({"role": "assistant", "content": meta["bot"]})
-
-        return history, f"History for: {chat_name}"
-    except (requests.exceptions.RequestException, ValueError) as e:
-        handle_api_error(e, "fetching messages")
-        return [], "Error loading messages"
-    except (KeyError, TypeError) as e:
+        # Shielded so that one caller being cancelled does not abort the fetch for the others.
+        return await asyncio.shield(_start_history_fetch(auth_token, chat_id))
+    except ijson.JSONError as e:
         log_and_warn(f"Error parsing response: {e}")
         return [], "Could not parse message response"
+    except (httpx.HTTPError, ValueError) as e:
+        handle_api_error(e, "fetching messages")
+        return [], "Error loading messages"
+
+def prefetch_chat_messages(auth_token, chat_id):
+    """Starts loading a chat history into the cache in the background, unless already cached or loading."""
+    if (auth_token, chat_id) not in HISTORY_CACHE:
+        _start_history_fetch(auth_token, chat_id).add_done_callback(_log_prefetch_error)
+
+def _log_prefetch_error(task):
+    """Logs a failed background prefetch; users only get a warning if they open the chat."""
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning(f"Error prefetching messages: {task.exception()}")
+
+def _start_history_fetch(auth_token, chat_id):
+    """Returns the in-flight fetch task for a chat history, starting one if needed."""
+    key = (auth_token, chat_id)
+    task = HISTORY_FETCHES.get(key)
+    if task is None:
+        task = HISTORY_FETCHES[key] = asyncio.ensure_future(_fetch_chat_messages(auth_token, chat_id))
+        task.add_done_callback(lambda done: HISTORY_FETCHES.pop(key) if HISTORY_FETCHES.get(key) is done else None)
+    return task
+
+async def _fetch_chat_messages(auth_token, chat_id):
+    """Downloads and parses a chat history for get_chat_messages and prefetch_chat_messages.
+
+    Runs as a task shared by every caller, so errors are raised for each of them
+    to report rather than shown from here.
+    """
+    key = (auth_token, chat_id)
+    etag_key = ("get_messages", auth_token, chat_id)
+    headers, cached_result = with_etag(get_headers(auth_token), etag_key)
+    params = {"chat_id": chat_id}
+    async with CLIENT.stream("POST", URL["get_messages"], headers=headers, params=params) as response:
+        if response.status_code in NOT_MODIFIED_STATUSES and cached_result is not None:
+            result = cached_result
+        else:
+            if response.is_error:
+                await response.aread()  # Makes the error body available to handle_api_error
+            response.raise_for_status()
+            result = await _parse_chat_messages(response)
+            remember_etag(etag_key, response, result)
+
+    if HISTORY_FETCHES.get(key) is asyncio.current_task():
+        HISTORY_CACHE[key] = result
+    return result
+
+async def _parse_chat_messages(response):
+    """Parses a streamed /giveAll response into the chatbot history and a status label."""
+    # Parse the body incrementally as it arrives, keeping only the fields
+    # we display instead of materialising the whole response tree. Parsing
+    # runs in worker threads so long histories do not stall Gradio's event loop.
+    events = ijson.sendable_list()
+    parser = ijson.parse_coro(events)
+    chat_name = "Current Chat"
+    exchanges = []
+    add_exchange = exchanges.append
+    text = bot = None
+
+    def consume(chunk):
+        nonlocal chat_name, text, bot
+        parser.send(chunk)
+        for prefix, event, value in events:
+            if prefix == "Messages.points.item.metadata.text":
+                text = value
+            elif prefix == "Messages.points.item.metadata.bot":
+                bot = value
+            elif prefix == "Messages.points.item" and event == "end_map":
+                add_exchange((text, bot))
+                text = bot = None
+            elif prefix == "Name":
+                chat_name = value
+        del events[:]
+
+    def finish():
+        parser.close()
+        # Display user and bot messages in order, skipping empty ones
+        return [
+            {"role": role, "content": content}
+            for text, bot in exchanges
+            for role, content in (("user", text), ("assistant", bot))
+            if content
+        ]
+
+    async for chunk in response.aiter_bytes():
+        await asyncio.to_thread(consume, chunk)
+    history = await asyncio.to_thread(finish)
+    return history, f"History for: {chat_name}"
 
-def send_message_and_get_reply(auth_token, chat_id, text):
-    """Sends a message to the cat and gets the full chat history back."""
+async def stream_message_reply(auth_token, user_id, chat_id, text):
+    """Sends a message over the Cat's WebSocket and yields (reply so far, is complete) as it streams in.
+
+    Yields ("", False) as soon as the message has been sent, so callers can tell a
+    message that never left from a reply that failed or was cut off afterwards.
+    """
     if not chat_id:
         log_and_warn("Cannot send message: no chat selected.")
-        return None
+        return
     if not text.strip():
         log_and_warn("Cannot send an empty message.")
-        return None
+        return
 
     try:
-        headers = get_headers(auth_token)
-        payload = {"text": text, "chat_id": chat_id}
-        send_response = requests.post(
-            f"{BASE_URL}{API_ENDPOINTS['send_message']}",
-            headers=headers,
-            json=payload,
-            stream=False
-        )
-        send_response.raise_for_status()
-
-        # NOTE: This delay is a workaround for eventual consistency in the backend.
-        # The Cheshire Cat API processes messages asynchronously. After sending a
-        # message, it may take a moment for the new message to be reflected in the
-        # chat history. This sleep provides a buffer to increase the chances that
-        # the subsequent 'get_chat_messages' call retrieves the updated history.
-        # In a production system, a more robust solution like WebSockets or
-        # server-sent events would be preferable for real-time updates.
-        time.sleep(1) 
-        
-        updated_history, _ = get_chat_messages(auth_token, chat_id)
-        
-        return updated_history
+        get_headers(auth_token)  # Validates the token before opening the socket
+        url = f"{URL['websocket']}/{quote(user_id or 'user')}?token={quote(auth_token)}"
+        async with websockets.connect(url) as ws:
+            # Decoded so the payload goes out as a text frame, which the Cat expects.
+            await ws.send(orjson.dumps({"text": text, "chat_id": chat_id}).decode())
+            yield "", False
+
+            reply = ""
+            pending = False  # Tokens received but not yet yielded
+            received = False  # Whether any frame has arrived yet
+            last_update = 0.0
+            while True:
+                timeout = REPLY_TIMEOUT if received else FIRST_REPLY_TIMEOUT
+                if pending:
+                    # Wake up when the repaint interval ends, so held-back tokens
+                    # are shown even if the Cat pauses mid-reply.
+                    timeout = max(0.0, last_update + STREAM_UPDATE_INTERVAL - time.monotonic())
+                try:
+                    frame = await asyncio.wait_for(ws.recv(), timeout)
+                except asyncio.TimeoutError:
+                    if not pending:
+                        log_and_warn(f"Error in sending message: no reply from the Cat within {timeout:g} seconds.")
+                        return
+                    last_update, pending = time.monotonic(), False
+                    yield reply, False
+                    continue
+
+                received = True
+                event = orjson.loads(frame)
+                event_type = event.get("type")
+                if event_type == "chat_token":
+                    reply += event.get("content", "")
+                    now = time.monotonic()
+                    if now - last_update < STREAM_UPDATE_INTERVAL:
+                        pending = True
+                    else:
+                        last_update, pending = now, False
+                        yield reply, False
+                elif event_type == "chat":
+                    # The final message carries the complete reply ("text" on
+                    # newer Cat versions, "content" on older ones).
+                    yield event.get("text") or event.get("content") or reply, True
+                    return
+                elif event_type == "error":
+                    log_and_warn(f"Error from the Cat: {event.get('description') or event.get('name')}")
+                    return
+
+    except ConnectionClosedOK:
+        # A clean close before the final "chat" frame still means the reply is incomplete
+        log_and_warn("Error in sending message: the Cat closed the connection before the reply was complete.")
+    except asyncio.TimeoutError:
+        # Only the opening handshake can time out here; reply waits are handled above
+        log_and_warn("Error in sending message: timed out connecting to the Cat.")
+    except (WebSocketException, OSError, ValueError) as e:
+        # WebSocket errors carry no JSON body, so skip handle_api_error's response parsing.
+        log_and_warn(f"Error in sending message: {e}")
 
-    except (requests.exceptions.RequestException, ValueError) as e:
-        handle_api_error(e, "sending message")
-        return None
-    
 # --- Gradio UI ---
 
 with gr.Blocks(theme=gr.themes.Soft(), title="Simple Multi Chat UI for Cheshire Cat") as demo:
     
     # State variables to hold session data
     auth_token_state = gr.State(None)
-    chat_list_data_state = gr.State([])
+    user_id_state = gr.State(None)
+    chat_list_data_state = gr.State({})
     selected_chat_id_state = gr.State(None) 
+    # Server-side copy of the displayed history, so sending a message does not
+    # upload the whole chatbot value from the browser
+    chat_history_state = gr.State([])
 
     gr.Markdown("# 🐈 Simple Multi Chat UI for Cheshire Cat")
     
@@ -252,135 +503,176 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Simple Multi Chat UI for Cheshire
 # --- UI Logic & Event Handlers ---
 
     # Centralized function to refresh chat list and update UI components
-    def refresh_and_update_components(auth_token):
-        """Fetches all chats and updates the selector with (name, id) choices."""
+    async def refresh_and_update_components(auth_token, prefetch=True):
+        """Fetches all chats and updates the selector with (name, id) choices and the id -> name map."""
         if not auth_token:
-            return gr.update(choices=[]), []
+            return gr.update(choices=[]), {}
             
-        chats = get_chats(auth_token)
-        return gr.update(choices=chats, value=None), chats
+        chats = await get_chats(auth_token)
+        if prefetch:
+            for _, chat_id in chats[:PREFETCH_CHATS]:
+                prefetch_chat_messages(auth_token, chat_id)
+        return gr.update(choices=chats, value=None), {chat_id: name for name, chat_id in chats}
 
-    def login(username, password):
+    async def login(username, password):
         """Handles user authentication, fetches the token, and switches to the main view."""
         if not username or not password:
             gr.Warning("Username and Password are required.")
-            return gr.update(visible=True), gr.update(visible=False), None, [], gr.update(choices=[])
+            return gr.update(visible=True), gr.update(visible=False), None, None, {}, gr.update(choices=[])
         
         try:
-            response = requests.post(
-                f"{BASE_URL}{API_ENDPOINTS['token']}",
-                headers={"Content-Type": "application/json"},
-                json={"username": username, "password": password}
-            )
-            response.raise_for_status()
-            
-            token_data = response.json()
-            auth_token = token_data.get("access_token")
+            token_key = (username, hashlib.blake2b(password.encode(), digest_size=16).hexdigest())
+            auth_token, _ = TOKEN_CACHE.get(token_key, (None, None))
+            if auth_token is None:
+                response = await CLIENT.post(
+                    URL["token"],
+                    content=orjson.dumps({"username": username, "password": password})
+                )
+                response.raise_for_status()
+                
+                token_data = orjson.loads(response.content)
+                auth_token = token_data.get("access_token")
 
-            if not auth_token:
-                gr.Warning("Login failed: No token received.")
-                return gr.update(visible=True), gr.update(visible=False), None, [], gr.update(choices=[])
+                if not auth_token:
+                    gr.Warning("Login failed: No token received.")
+                    return gr.update(visible=True), gr.update(visible=False), None, None, {}, gr.update(choices=[])
+                expires_at = token_expiry(auth_token)
+                if expires_at is not None:
+                    TOKEN_CACHE[token_key] = (auth_token, expires_at - TOKEN_EXPIRY_MARGIN)
 
             log_and_success("Login successful.")
             
-            chat_choices, chat_list = refresh_and_update_components(auth_token)
+            chat_choices, chat_map = await refresh_and_update_components(auth_token)
         
-            return gr.update(visible=False), gr.update(visible=True), auth_token, chat_list, chat_choices
+            return gr.update(visible=False), gr.update(visible=True), auth_token, username, chat_map, chat_choices
             
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             if e.response.status_code == 401:
                 gr.Warning("Invalid username or password.")
             else:
                 handle_api_error(e, "authentication")
-            return gr.update(visible=True), gr.update(visible=False), None, [], gr.update(choices=[])
-        except requests.exceptions.RequestException as e:
+            return gr.update(visible=True), gr.update(visible=False), None, None, {}, gr.update(choices=[])
+        except httpx.HTTPError as e:
             handle_api_error(e, "authentication")
-            return gr.update(visible=True), gr.update(visible=False), None, [], gr.update(choices=[])
+            return gr.update(visible=True), gr.update(visible=False), None, None, {}, gr.update(choices=[])
 
-    def logout():
+    async def logout(auth_token):
         """Logs the user out, clears all states, and returns to the login screen."""
+        forget_token(auth_token)  # Async handler, so the token cache is only touched on the event loop
         log_and_info("User logged out.")
         return (
             gr.update(visible=True),      # Show login view
             gr.update(visible=False),     # Hide main view
             None,                         # Clear auth token
-            [],                           # Clear chat list data
+            None,                         # Clear user ID
+            {},                           # Clear chat list data
             None,                         # Clear selected chat ID
             [],                           # Clear chatbot history
+            [],                           # Clear chat history state
             gr.update(choices=[], value=None), # Reset chat selector
             "",                           # Clear username input
             ""                            # Clear password input
         )
 
-    def get_name_from_id(selected_id, chat_list):
+    def get_name_from_id(selected_id, chat_map):
         """Helper to find a chat's name from its unique ID in the state."""
-        return next((name for name, chat_id in chat_list if chat_id == selected_id), None)
+        return chat_map.get(selected_id)
 
-    def on_chat_select(selected_id, auth_token):
+    async def on_chat_select(selected_id, auth_token):
         """Handles chat selection: fetches and displays its message history."""
         if selected_id:
-            history, _ = get_chat_messages(auth_token, selected_id)
-            return history, selected_id
-        return [], None
+            history, _ = await get_chat_messages(auth_token, selected_id)
+            return history, history, selected_id
+        return [], [], None
 
-    def handle_create_chat(name, auth_token):
+    async def handle_create_chat(name, auth_token):
         """Creates a new chat and refreshes the chat list."""
-        create_chat(auth_token, name)
-        updated_choices, updated_list = refresh_and_update_components(auth_token)
+        await create_chat(auth_token, name)
+        updated_choices, updated_list = await refresh_and_update_components(auth_token, prefetch=False)
         return updated_choices, updated_list, "" # Clear input field
 
-    def handle_delete_chat(selected_id, chat_list_data, auth_token):
+    async def handle_delete_chat(selected_id, chat_map, auth_token):
         """Deletes the selected chat and refreshes the list."""
         if selected_id:
-            chat_name = get_name_from_id(selected_id, chat_list_data) or selected_id
-            delete_chat(auth_token, selected_id)
+            chat_name = get_name_from_id(selected_id, chat_map) or selected_id
+            await delete_chat(auth_token, selected_id)
+            invalidate_chat_history(selected_id)
             log_and_success(f"Chat '{chat_name}' deleted.")
-            updated_choices, updated_list = refresh_and_update_components(auth_token)
-            return updated_choices, updated_list, None, [] # Reset selector and history
+            updated_choices, updated_list = await refresh_and_update_components(auth_token, prefetch=False)
+            return updated_choices, updated_list, None, [], [] # Reset selector and history
         else:
             log_and_warn("No chat selected to delete.")
-            return gr.update(), gr.update(), gr.update(), gr.update()
+            return gr.update(), gr.update(), gr.update(), gr.update(), gr.update()
             
-    def handle_rename_chat(selected_id, new_name, auth_token):
+    async def handle_rename_chat(selected_id, new_name, auth_token):
         """Renames the selected chat and refreshes the list."""
         if not selected_id:
             gr.Warning("Please select a chat to rename.")
             return gr.update(), gr.update(), new_name
 
-        rename_chat(auth_token, selected_id, new_name)
-        refreshed_choices, refreshed_list = refresh_and_update_components(auth_token)
+        await rename_chat(auth_token, selected_id, new_name)
+        refreshed_choices, refreshed_list = await refresh_and_update_components(auth_token, prefetch=False)
         return refreshed_choices, refreshed_list, "" # Clear input
 
-    def handle_send_and_refresh(selected_chat_id, text, auth_token):
-        """Sends a message, then refreshes and displays the updated chat history."""
+    async def handle_send_and_refresh(selected_chat_id, text, history, auth_token, user_id):
+        """Sends a message and streams the bot reply into the chat history as it arrives."""
         if not selected_chat_id:
             log_and_warn("Please select a chat first.")
-            return [], ""
-            
-        updated_history = send_message_and_get_reply(auth_token, selected_chat_id, text)
-        
-        # If the API call failed, updated_history will be None. Keep the old history.
-        if updated_history is None:
-            # To avoid losing the current view, we just return the current history
-            # A better approach could be to return gr.update() to not change the component
-            current_history, _ = get_chat_messages(auth_token, selected_chat_id)
-            return current_history, text # Return original text to not clear input
-
-        return updated_history, "" # Clear input on success
-        
+            yield [], "", []
+            return
+
+        # The history comes from chat_history_state rather than the chatbot, so the
+        # browser does not upload the whole conversation with every message. The
+        # new turn goes on a copy, leaving the (possibly cached) history untouched.
+        history = history or []
+        updated_history = history + [{"role": "user", "content": text}]
+        if text.strip():
+            # Show the user's message right away, before the Cat starts answering
+            yield updated_history, "", updated_history
+
+        reply_message = {"role": "assistant", "content": ""}
+        sent = complete = False
+        async for reply, complete in stream_message_reply(auth_token, user_id, selected_chat_id, text):
+            sent = True
+            if not reply and not complete:
+                continue  # Only confirms that the message went out
+            if updated_history[-1] is not reply_message:
+                updated_history.append(reply_message)
+            reply_message["content"] = reply
+            yield updated_history, "", updated_history
+
+        # If the message never reached the Cat, keep the current view and the typed text.
+        if not sent:
+            yield history, text, history
+            return
+
+        # The Cat has the message now, so its cached history is stale even if the
+        # reply failed. Keep the user's turn and mark the reply as cut off rather
+        # than restoring the input, which would invite sending it twice.
+        invalidate_chat_history(selected_chat_id)
+        if not complete:
+            if reply_message["content"]:
+                reply_message["content"] += "\n\n*(Reply incomplete)*"
+            else:
+                reply_message["content"] = "*(Reply unavailable)*"
+            if updated_history[-1] is not reply_message:
+                updated_history.append(reply_message)
+            yield updated_history, "", updated_history
+
 # --- Event Handler Wiring ---
 
     login_btn.click(
         fn=login,
         inputs=[username_input, password_input],
-        outputs=[login_view, main_view, auth_token_state, chat_list_data_state, chat_selector_radio]
+        outputs=[login_view, main_view, auth_token_state, user_id_state, chat_list_data_state, chat_selector_radio]
     )
 
     logout_btn.click(
         fn=logout,
+        inputs=[auth_token_state],
         outputs=[
-            login_view, main_view, auth_token_state, chat_list_data_state, 
-            selected_chat_id_state, chatbot, chat_selector_radio, 
+            login_view, main_view, auth_token_state, user_id_state, chat_list_data_state, 
+            selected_chat_id_state, chatbot, chat_history_state, chat_selector_radio, 
             username_input, password_input
         ]
     )
@@ -391,10 +683,14 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Simple Multi Chat UI for Cheshire
         outputs=[chat_selector_radio, chat_list_data_state]
     )
 
+    # Only the latest selection is processed when the user moves through the
+    # list faster than histories load; intermediate ones are dropped.
     chat_selector_radio.change(
         fn=on_chat_select,
         inputs=[chat_selector_radio, auth_token_state],
-        outputs=[chatbot, selected_chat_id_state]
+        outputs=[chatbot, chat_history_state, selected_chat_id_state],
+        trigger_mode="always_last",
+        show_progress="hidden"
     )
     
     create_chat_btn.click(
@@ -406,7 +702,7 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Simple Multi Chat UI for Cheshire
     delete_chat_btn.click(
         fn=handle_delete_chat,
         inputs=[selected_chat_id_state, chat_list_data_state, auth_token_state],
-        outputs=[chat_selector_radio, chat_list_data_state, selected_chat_id_state, chatbot]
+        outputs=[chat_selector_radio, chat_list_data_state, selected_chat_id_state, chatbot, chat_history_state]
     )
 
     rename_chat_btn.click(
@@ -418,14 +714,18 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Simple Multi Chat UI for Cheshire
     # Trigger message sending on button click or Enter key press
     send_btn.click(
         fn=handle_send_and_refresh,
-        inputs=[selected_chat_id_state, message_input, auth_token_state],
-        outputs=[chatbot, message_input]
+        inputs=[selected_chat_id_state, message_input, chat_history_state, auth_token_state, user_id_state],
+        outputs=[chatbot, message_input, chat_history_state]
     )
     message_input.submit(
         fn=handle_send_and_refresh,
-        inputs=[selected_chat_id_state, message_input, auth_token_state],
-        outputs=[chatbot, message_input]
+        inputs=[selected_chat_id_state, message_input, chat_history_state, auth_token_state, user_id_state],
+        outputs=[chatbot, message_input, chat_history_state]
     )
 
+# All handlers are async and spend their time waiting on the Cat, so let
+# several of them run at once instead of Gradio's default of one per event.
+demo.queue(default_concurrency_limit=16, max_size=64)
+
 if __name__ == "__main__":
     demo.launch() 
\ No newline at end of file